@@ -39,6 +39,7 @@ volumetric_type = {
 edge_type = {
     "neighbors": "list[string]",
     "surface_area": "float",
+    "distance": "float",
 }
 
 compartment_type = {
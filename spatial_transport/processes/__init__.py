@@ -1,8 +1,10 @@
 import spatial_transport
 from spatial_transport.processes.diffusion import SimpleDiffusion
 from spatial_transport.processes.advection import SimpleAdvection
+from spatial_transport.processes.cached_dfba import CachedDFBA
 
 def register_processes(core):
     core.register_process("SimpleDiffusion", SimpleDiffusion)
     core.register_process("SimpleAdvection", SimpleAdvection)
+    core.register_process("CachedDFBA", CachedDFBA)
     return core
\ No newline at end of file
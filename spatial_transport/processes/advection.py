@@ -22,7 +22,6 @@ class SimpleAdvection(Process):
 
         self.substrates = config['substrates']
         self.spacing = config['spacing']
-        self.area = config['spacing'] ** 2
         self.advection = np.array(config['advection'])
         self.boundary = config['boundary']
 
@@ -43,13 +42,12 @@ class SimpleAdvection(Process):
 
         # position_to_key = {tuple(v['position']): k for k, v in compartments.items()}
         positions = np.array([v['position'] for v in compartments.values()])
+        sizes = np.array([v.get('size') or self.spacing for v in compartments.values()])
 
-        # Determine bounds in each dimension
-        x_vals, y_vals, z_vals = positions[:, 0], positions[:, 1], positions[:, 2]
-        x_min, x_max = x_vals.min(), x_vals.max()
-        y_min, y_max = y_vals.min(), y_vals.max()
-        z_min, z_max = z_vals.min(), z_vals.max()
-        max_values = {'x': x_max, 'y': y_max, 'z': z_max}
+        # Determine the extent of the domain in each dimension from the corners of the voxels
+        lower = (positions - sizes[:, None] / 2).min(axis=0)
+        upper = (positions + sizes[:, None] / 2).max(axis=0)
+        lengths = {dim: upper[i] - lower[i] for i, dim in enumerate(['x', 'y', 'z'])}
 
         update = {
             compartment_id: {
@@ -68,20 +66,22 @@ class SimpleAdvection(Process):
             conc2 = compartments[compartment2]['Shared Environment']['concentrations']
             pos1 = np.array(compartments[compartment1]["position"])
             pos2 = np.array(compartments[compartment2]["position"])
-            if self.boundary == "default":
+            if edge.get("normal"):
+                # edges between voxels of different sizes carry their face normal
+                normal1 = np.array(edge["normal"])
+            elif self.boundary == "default":
                 normal1 = (pos2 - pos1) / np.linalg.norm(pos2 - pos1)
-            if self.boundary == "periodic":
+            elif self.boundary == "periodic":
                 if not edge["periodic"]:
                     normal1 = (pos2 - pos1)/np.linalg.norm(pos2 - pos1)
                 if edge["periodic"]:
                     boundaries1 = compartments[compartment1]['boundaries']
                     boundaries2 = compartments[compartment2]['boundaries']
                     for i, dim in enumerate(['x', 'y', 'z']):
-                        dim_max = max_values[dim]
                         if f"{dim}_max" in boundaries2 and f"{dim}_min" in boundaries1:
-                            pos1[i] += (dim_max + self.spacing/2)
+                            pos1[i] += lengths[dim]
                         if f"{dim}_max" in boundaries1 and f"{dim}_min" in boundaries2:
-                            pos2[i] += (dim_max + self.spacing/2)
+                            pos2[i] += lengths[dim]
                     # print(f"{edge_id} : {np.array(compartments[compartment1]["position"])} : {pos1}")
                     # print(f"{edge_id} : {np.array(compartments[compartment2]["position"])} : {pos2}")
                     normal1 = (pos2 - pos1) / np.linalg.norm(pos2 - pos1)
@@ -91,9 +91,9 @@ class SimpleAdvection(Process):
                 concentration1 = conc1[substrate]
                 concentration2 = conc2[substrate]
                 if vn > 0:
-                    delta1 = -vn * concentration1 * self.area * interval
+                    delta1 = -vn * concentration1 * edge["surface_area"] * interval
                 else:
-                    delta1 = -vn * concentration2 * self.area * interval
+                    delta1 = -vn * concentration2 * edge["surface_area"] * interval
                 update[edge["neighbors"][0]]["Shared Environment"]["counts"][substrate] += delta1
                 update[edge["neighbors"][1]]["Shared Environment"]["counts"][substrate] += -delta1
 
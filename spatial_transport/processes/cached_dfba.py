@@ -0,0 +1,191 @@
+import atexit
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from threading import Lock
+
+from process_bigraph import Process
+from cdFBA.processes.dfba import dFBA
+from cdFBA.utils import model_from_file, get_objective_reaction
+
+#Shared Model Cache
+
+_parsed_models = {}  # model_file -> (modification time, parsed cobra model)
+_configured_models = {}  # model setup key -> (cobra model, lock)
+
+def _modification_time(model_file):
+    if isinstance(model_file, str) and os.path.exists(model_file):
+        return os.path.getmtime(model_file)
+    return None
+
+def load_model(model_file):
+    """
+    Returns the parsed cobra model for a model file path or BiGG Model ID, parsing it only once.
+
+    A model whose file changed on disk since it was parsed is parsed again. The returned model is
+    shared and must not be modified.
+    """
+    mtime = _modification_time(model_file)
+    cached = _parsed_models.get(model_file)
+    if cached is None or cached[0] != mtime:
+        _parsed_models[model_file] = (mtime, model_from_file(model_file))
+        for key in [key for key in _configured_models if key[0] == model_file]:
+            del _configured_models[key]
+    return _parsed_models[model_file][1]
+
+def clear_model_cache():
+    """Drops every parsed and configured model, e.g. to free memory between simulations"""
+    _parsed_models.clear()
+    _configured_models.clear()
+
+def _setup_key(config):
+    """
+    Identifies the model setup (medium, bounds and changes) applied on top of the parsed model.
+
+    The reactions of the reaction_map are part of the key: dFBA.update only resets the bounds of its
+    own mapped reactions, so instances mapping different reactions must not share a model.
+    """
+    setup = {key: config.get(key) for key in ("medium", "bounds", "changes")}
+    setup["reactions"] = sorted((config.get("reaction_map") or {}).values())
+    return config["model_file"], json.dumps(setup, sort_keys=True, default=str)
+
+def _configure_model(model, config):
+    """Applies the medium, bounds and changes of a dFBA config to a model, as dFBA.__init__ does"""
+    if config["medium"]:
+        model.medium = config["medium"]
+
+    if config["bounds"]:
+        for reaction_id, bounds in config["bounds"].items():
+            if bounds["lower"] is not None:
+                model.reactions.get_by_id(reaction_id).lower_bound = bounds["lower"]
+            if bounds["upper"] is not None:
+                model.reactions.get_by_id(reaction_id).upper_bound = bounds["upper"]
+
+    changes = config["changes"]
+    if changes is not None:
+        for gene in changes["gene_knockout"] or []:
+            model.genes.get_by_id(gene).knock_out()
+        for reaction in changes["reaction_knockout"] or []:
+            model.reactions.get_by_id(reaction).knock_out()
+        for reaction_id, bounds in (changes["bounds"] or {}).items():
+            if bounds["lower"] is not None:
+                model.reactions.get_by_id(reaction_id).lower_bound = bounds["lower"]
+            if bounds["upper"] is not None:
+                model.reactions.get_by_id(reaction_id).upper_bound = bounds["upper"]
+    return model
+
+def get_configured_model(config):
+    """
+    Returns the shared model and its lock for a dFBA config.
+
+    Every instance with the same model file and setup gets the same model, so a model is parsed
+    once and copied once per distinct setup, not once per voxel.
+    """
+    model = load_model(config["model_file"])
+    key = _setup_key(config)
+    if key not in _configured_models:
+        _configured_models[key] = (_configure_model(model.copy(), config), Lock())
+    return _configured_models[key]
+
+#Worker Pool
+
+_worker_pool = None
+_worker_pool_size = None  # workers the running pool was started with
+_solvers = {}  # model setup key -> _Solver, one per worker process
+
+def get_worker_pool(workers=0):
+    """Returns the process pool shared by all pooled CachedDFBA instances, starting it if needed
+
+    Parameters:
+        workers: int, number of worker processes, 0 for one per CPU. Must match the running pool;
+                 call shutdown_worker_pool first to start a pool of another size.
+    """
+    global _worker_pool, _worker_pool_size
+    if _worker_pool is None:
+        _worker_pool = ProcessPoolExecutor(max_workers=workers or None)
+        _worker_pool_size = workers
+    elif workers != _worker_pool_size:
+        raise ValueError(f"the worker pool is running with workers={_worker_pool_size}, got workers={workers}; "
+                         f"call shutdown_worker_pool first to change its size")
+    return _worker_pool
+
+def shutdown_worker_pool():
+    """Stops the worker processes; a later pooled update starts a new pool"""
+    global _worker_pool, _worker_pool_size
+    if _worker_pool is not None:
+        _worker_pool.shutdown()
+        _worker_pool = None
+        _worker_pool_size = None
+
+atexit.register(shutdown_worker_pool)
+
+class _Solver:
+    """Holds what dFBA.update reads, so that the same update can run in a worker process"""
+    update = dFBA.update
+
+    def __init__(self, config):
+        self.config = config
+        self.model, self.lock = get_configured_model(config)
+        self.biomass_identifier = get_objective_reaction(self.model)
+
+def _solve(config, inputs, interval):
+    key = _setup_key(config)
+    if key not in _solvers:
+        _solvers[key] = _Solver(config)
+    solver = _solvers[key]
+    solver.config = config
+    return solver.update(inputs, interval)
+
+class FutureUpdate:
+    """Update of a solve running in the worker pool, collected when the Composite applies updates"""
+    def __init__(self, future):
+        self.future = future
+
+    def get(self):
+        return self.future.result()
+
+class CachedDFBA(dFBA):
+    """dFBA that shares one cobra model between all instances with the same model setup
+
+    The model is parsed once per model file and configured once per setup and set of mapped
+    reactions. Every update sets the bounds of all the mapped reactions before solving, so the solve
+    of one instance does not depend on another; the lock keeps updates of instances sharing a model from interleaving.
+
+    With coupling "pool" the solves are sent to a shared process pool. The Composite invokes every
+    process due in a time step before it applies any update, so the solves of all voxels run in
+    parallel on the same state as the sequential solves. The Composite invokes processes in the order
+    they appear in its spec, so transport processes only run alongside the solves if they come after
+    the CachedDFBA instances, i.e. if the voxels are added to the spec before the transport processes.
+    All pooled instances must use the same number of workers.
+    """
+    config_schema = {
+        **dFBA.config_schema,
+        "coupling": {"_type": "string", "_default": "sequential"}, # sequential or pool
+        "workers": {"_type": "integer", "_default": 0}, # worker processes of the pool, 0 for one per CPU
+    }
+
+    def __init__(self, config, core):
+        Process.__init__(self, config, core)
+
+        if self.config["coupling"] not in ("sequential", "pool"):
+            raise ValueError(f"coupling must be 'sequential' or 'pool', got {self.config['coupling']!r}")
+        if self.config["workers"] < 0:
+            raise ValueError(f"workers must be 0 or more, got {self.config['workers']}")
+
+        self.model, self.lock = get_configured_model(self.config)
+        self.biomass_identifier = get_objective_reaction(self.model)
+
+        changes = self.config["changes"]
+        if changes is not None and changes["kinetics"]:
+            # copy instead of updating in place, the kinetics may be shared between voxels
+            self.config["kinetics"] = {**self.config["kinetics"], **changes["kinetics"]}
+
+    def invoke(self, state, interval):
+        if self.config["coupling"] == "sequential":
+            return super().invoke(state, interval)
+        future = get_worker_pool(self.config["workers"]).submit(_solve, self.config, state, interval)
+        return FutureUpdate(future)
+
+    def update(self, inputs, interval):
+        with self.lock:
+            return super().update(inputs, interval)
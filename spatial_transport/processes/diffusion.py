@@ -1,4 +1,5 @@
 from pprint import pprint
+import numpy as np
 
 from process_bigraph import Process, Composite, ProcessTypes
 from process_bigraph.emitter import emitter_from_wires, gather_emitter_results
@@ -10,7 +11,12 @@ import matplotlib.pyplot as plt
 #Diffusion Processes
 
 class SimpleDiffusion(Process):
-    """Simple diffusion between compartments"""
+    """Simple diffusion between compartments
+
+    The flux across an edge is D * (c2 - c1) * surface_area / distance. The neighbor indices and the
+    conductance (surface_area / distance) of every edge are cached, and only rebuilt when the set of
+    compartments or edges changes.
+    """
     config_schema = {
         "substrates": "map[float]",
     }
@@ -19,6 +25,11 @@ class SimpleDiffusion(Process):
         super().__init__(config, core)
 
         self.substrates = config['substrates']
+        self.substrate_names = list(self.substrates.keys())
+        self.diffusivity = np.array([self.substrates[substrate] for substrate in self.substrate_names])
+        self.edge_cache_key = None
+        self.edge_neighbors = None
+        self.conductance = None
 
     def inputs(self):
         return {
@@ -31,32 +42,43 @@ class SimpleDiffusion(Process):
             "compartments": "map[compartment]"
         }
 
+    def get_edge_arrays(self, compartments, edges):
+        cache_key = (tuple(compartments.keys()), tuple(edges.keys()))
+        if cache_key != self.edge_cache_key:
+            index = {compartment_id: i for i, compartment_id in enumerate(compartments.keys())}
+            self.edge_neighbors = np.array(
+                [[index[neighbor] for neighbor in edge["neighbors"]] for edge in edges.values()],
+                dtype=int).reshape(-1, 2)
+            surface_areas = np.array([edge["surface_area"] for edge in edges.values()], dtype=float)
+            distances = np.array([edge.get("distance", 0.0) for edge in edges.values()], dtype=float)
+            # edges without a distance (specs from before it was added) keep the unit separation
+            distances = np.where(distances > 0, distances, 1.0)
+            self.conductance = surface_areas / distances
+            self.edge_cache_key = cache_key
+        return self.edge_neighbors, self.conductance
+
     def update(self, inputs, interval):
         edges = inputs['edges']
         compartments = inputs['compartments']
 
+        neighbors, conductance = self.get_edge_arrays(compartments, edges)
+        concentrations = np.array([
+            [compartment['Shared Environment']['concentrations'][substrate] for substrate in self.substrate_names]
+            for compartment in compartments.values()], dtype=float).reshape(len(compartments), len(self.substrate_names))
+
+        flux = (concentrations[neighbors[:, 1]] - concentrations[neighbors[:, 0]]) \
+            * conductance[:, None] * self.diffusivity * interval
+        delta = np.zeros_like(concentrations)
+        np.add.at(delta, neighbors[:, 0], flux)
+        np.add.at(delta, neighbors[:, 1], -flux)
+
         update = {
             compartment_id: {
                 "Shared Environment": {
-                    'counts': {
-                        substrate: 0 for substrate in self.substrates.keys()
-                    },
+                    'counts': dict(zip(self.substrate_names, row)),
                 }
             }
-            for compartment_id in compartments.keys()}
-
-        for edge_id, edge in edges.items():
-            compartment1 = compartments[edge["neighbors"][0]]
-            compartment2 = compartments[edge["neighbors"][1]]
-            conc1 = compartments[edge["neighbors"][0]]['Shared Environment']['concentrations']
-            conc2 = compartments[edge["neighbors"][1]]['Shared Environment']['concentrations']
-            for substrate in self.substrates.keys():
-                concentration1 = conc1[substrate]
-                concentration2 = conc2[substrate]
-                diffusivity = self.substrates[substrate]
-                d_conc = -diffusivity * (concentration2 - concentration1) * edge["surface_area"] * interval
-                update[edge["neighbors"][0]]["Shared Environment"]["counts"][substrate] += -d_conc
-                update[edge["neighbors"][1]]["Shared Environment"]["counts"][substrate] += d_conc
+            for compartment_id, row in zip(compartments.keys(), delta.tolist())}
         return {"compartments": update}
 
 def get_simple_diffusion_spec(substrates, interval):
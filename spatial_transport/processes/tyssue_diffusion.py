@@ -27,10 +27,14 @@ def get_tyssue_edges(sheet):
     opposites = list(sheet.edge_df.loc[sheet.east_edges]["opposite"])
     opposite_faces = list(sheet.edge_df.loc[opposites]["face"])
     neighbors = [[f"{faces[i]}", f"{opposite_faces[i]}"] for i in range(len(faces))]
+    centroids = sheet.face_df.loc[faces, sheet.coords].to_numpy()
+    opposite_centroids = sheet.face_df.loc[opposite_faces, sheet.coords].to_numpy()
+    distances = np.linalg.norm(centroids - opposite_centroids, axis=1)
     edges = {
         f"{i}": {
             "neighbors": neighbors[i],
-            "surface_area": float(lengths[i]*height)
+            "surface_area": float(lengths[i]*height),
+            "distance": float(distances[i]),
         }
         for i in range(len(faces))
     }
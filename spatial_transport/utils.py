@@ -1,8 +1,14 @@
 from pprint import pprint
+import copy
+import itertools
 import numpy as np
 import random
+from scipy.spatial import Voronoi
 import matplotlib.pyplot as plt
-from cdFBA.utils import get_substrates, make_cdfba_composite
+from cdFBA.utils import (get_substrates, get_kinetics, get_reaction_map, dfba_config, get_single_dfba_spec,
+                         get_initial_counts, initial_environment, environment_spec,
+                         DFBA_RESULTS, SHARED_ENVIRONMENT, SPECIES_STORE)
+from spatial_transport.processes.cached_dfba import load_model
 
 COMPARTMENTS = "Compartments"
 
@@ -65,6 +71,7 @@ def get_regular_edges(voxels, periodic=False, spacing=1.0):
                     edges[edge_label] = {}
                     edges[edge_label]['neighbors'] = [f"{comp}" for comp in edge_key]
                     edges[edge_label]['surface_area'] = spacing ** 2
+                    edges[edge_label]['distance'] = spacing
                     edges[edge_label]['periodic'] = wrapped
                     seen_pairs.add(edge_key)
                     edge_id += 1
@@ -95,6 +102,383 @@ def generate_voxels(dims, spacing):
 
     return voxels
 
+#Adaptive Mesh Functions
+def _voxel_size(voxel, spacing):
+    """Edge length of a voxel; uniform grids from generate_voxels carry no size and use spacing"""
+    return voxel.get("size", spacing)
+
+def _child_offsets(num_dims):
+    if num_dims == 3:
+        return list(itertools.product((-1, 1), repeat=3))
+    return [(dx, dy, 0) for dx, dy in itertools.product((-1, 1), repeat=2)]
+
+def refine_voxels(compartments, keys, spacing=1.0, num_dims=3):
+    """
+    Splits each voxel in keys into 2**num_dims children of half the edge length.
+
+    Children are keyed "<parent>.<i>" so that coarsen_voxels can find their siblings. Counts are
+    split evenly between children (piecewise-constant prolongation), which conserves the total
+    amount and keeps concentrations unchanged.
+
+    Parameters:
+        compartments: dict, voxels from generate_voxels or a previous refinement
+        keys: iterable of str, voxels to refine
+        spacing: float, edge length of voxels without a "size" entry
+        num_dims: int, number of dimensions (2 or 3)
+    """
+    keys = set(keys)
+    offsets = _child_offsets(num_dims)
+    n_children = len(offsets)
+    refined = {}
+    for key, voxel in compartments.items():
+        if key not in keys:
+            refined[key] = voxel
+            continue
+        size = _voxel_size(voxel, spacing)
+        extras = {k: v for k, v in voxel.items() if k not in ("position", "size", "boundaries", "Shared Environment")}
+        environment = voxel.get("Shared Environment")
+        for i, offset in enumerate(offsets):
+            child = copy.deepcopy(extras)
+            child["position"] = [float(p + o * size / 4) for p, o in zip(voxel["position"], offset)]
+            child["size"] = size / 2
+            if environment is not None:
+                volume = environment["volume"] / n_children
+                counts = {substrate: count / n_children for substrate, count in environment["counts"].items()}
+                child["Shared Environment"] = {
+                    "volume": volume,
+                    "counts": counts,
+                    "concentrations": {substrate: count / volume for substrate, count in counts.items()},
+                }
+            refined[f"{key}.{i}"] = child
+    if any("boundaries" in voxel for voxel in compartments.values()):
+        refined = detect_boundary_positions(refined, num_dims=num_dims, spacing=spacing)
+    return refined
+
+def coarsen_voxels(compartments, parents, spacing=1.0, num_dims=3):
+    """
+    Merges the children of each parent key back into a single voxel.
+
+    A parent is only restored when all of its 2**num_dims children are present as leaves. Counts and
+    volumes are summed (conservative restriction) and concentrations recomputed from the totals.
+
+    Parameters:
+        compartments: dict, voxels produced by refine_voxels
+        parents: iterable of str, keys of the voxels to restore
+        spacing: float, edge length of voxels without a "size" entry
+        num_dims: int, number of dimensions (2 or 3)
+    """
+    n_children = len(_child_offsets(num_dims))
+    merged = {}
+    for parent in parents:
+        child_keys = [f"{parent}.{i}" for i in range(n_children)]
+        if not all(child_key in compartments for child_key in child_keys):
+            continue
+        children = [compartments[child_key] for child_key in child_keys]
+        voxel = copy.deepcopy({k: v for k, v in children[0].items() if k not in ("position", "size", "boundaries", "Shared Environment")})
+        voxel["position"] = [float(p) for p in np.mean([child["position"] for child in children], axis=0)]
+        voxel["size"] = 2 * _voxel_size(children[0], spacing)
+        if "Shared Environment" in children[0]:
+            volume = sum(child["Shared Environment"]["volume"] for child in children)
+            counts = {}
+            for child in children:
+                for substrate, count in child["Shared Environment"]["counts"].items():
+                    counts[substrate] = counts.get(substrate, 0) + count
+            voxel["Shared Environment"] = {
+                "volume": volume,
+                "counts": counts,
+                "concentrations": {substrate: count / volume for substrate, count in counts.items()},
+            }
+        merged[parent] = voxel
+
+    coarsened = {}
+    for key, voxel in compartments.items():
+        parent = key.rsplit(".", 1)[0]
+        if "." in key and parent in merged:
+            if parent not in coarsened:
+                coarsened[parent] = merged[parent]
+        else:
+            coarsened[key] = voxel
+    if any("boundaries" in voxel for voxel in compartments.values()):
+        coarsened = detect_boundary_positions(coarsened, num_dims=num_dims, spacing=spacing)
+    return coarsened
+
+def get_adaptive_edges(voxels, periodic=False, spacing=1.0, num_dims=3):
+    """
+    Generates list of edge dictionaries for face neighbors in a quadtree/octree of cubic voxels
+
+    Voxels may differ in size by any power of two. The surface area of a non-conforming face is the
+    face of the smaller voxel, so a coarse voxel gets one edge to each of its finer neighbors. Each edge
+    carries the unit normal of its face, pointing from the first to the second neighbor, since the line
+    between the centers of voxels of different sizes is not normal to the face.
+
+    Parameters:
+        voxels: dict, voxels from generate_voxels, refine_voxels or coarsen_voxels
+        periodic: bool, whether to connect opposite sides of the domain
+        spacing: float, edge length of voxels without a "size" entry, also the depth of 2D domains
+        num_dims: int, number of dimensions (2 or 3)
+    """
+    sizes = {key: _voxel_size(voxel, spacing) for key, voxel in voxels.items()}
+    finest = min(sizes.values())
+
+    # index every voxel on the finest grid, relative to the lower corner of the domain:
+    # lower corner and width in finest cells
+    origin = [min(voxel["position"][dim] - sizes[key] / 2 for key, voxel in voxels.items())
+              for dim in range(num_dims)]
+    corners = {}
+    widths = {}
+    lookup = {}
+    for key, voxel in voxels.items():
+        width = int(round(sizes[key] / finest))
+        corner = tuple(int(round((voxel["position"][dim] - sizes[key] / 2 - origin[dim]) / finest))
+                       for dim in range(num_dims))
+        if any(c % width for c in corner):
+            raise ValueError(f"voxel {key} is not aligned to a grid of its size, voxels must form a quadtree/octree")
+        corners[key] = corner
+        widths[key] = width
+        lookup[(width, tuple(c // width for c in corner))] = key
+    extent = [max(corners[key][dim] + widths[key] for key in voxels) for dim in range(num_dims)]
+    all_widths = sorted(set(widths.values()))
+
+    def owner(cell):
+        for width in all_widths:
+            key = lookup.get((width, tuple(c // width for c in cell)))
+            if key is not None:
+                return key
+        return None
+
+    edges = {}
+    edge_id = 1
+    seen_pairs = set()
+
+    for key in voxels:
+        corner, width = corners[key], widths[key]
+        for axis in range(num_dims):
+            others = [dim for dim in range(num_dims) if dim != axis]
+            neighbors = {}
+            for face in itertools.product(*[range(corner[dim], corner[dim] + width) for dim in others]):
+                cell = [0] * num_dims
+                cell[axis] = corner[axis] + width
+                for dim, c in zip(others, face):
+                    cell[dim] = c
+                wrapped = cell[axis] >= extent[axis]
+                if wrapped:
+                    if not periodic:
+                        break
+                    cell[axis] -= extent[axis]
+                neighbor_key = owner(cell)
+                if neighbor_key is not None:
+                    neighbors[neighbor_key] = wrapped
+            for neighbor_key, wrapped in neighbors.items():
+                if neighbor_key == key:
+                    continue
+                edge_key = (tuple(sorted([key, neighbor_key])), axis, wrapped)
+                if edge_key in seen_pairs:
+                    continue
+                face_size = min(sizes[key], sizes[neighbor_key])
+                edge_label = f"{edge_id}"
+                edges[edge_label] = {}
+                edges[edge_label]['neighbors'] = [key, neighbor_key]
+                edges[edge_label]['surface_area'] = face_size ** 2 if num_dims == 3 else face_size * spacing
+                edges[edge_label]['distance'] = (sizes[key] + sizes[neighbor_key]) / 2
+                edges[edge_label]['periodic'] = wrapped
+                edges[edge_label]['normal'] = [1.0 if dim == axis else 0.0 for dim in range(3)]
+                seen_pairs.add(edge_key)
+                edge_id += 1
+    return edges
+
+def get_voxel_gradients(compartments, edges, substrates, spacing=1.0):
+    """
+    Largest concentration gradient across any face of each voxel
+
+    Returns:
+        gradients: dict {key: max over edges and substrates of |delta c| / center distance}
+    """
+    gradients = {key: 0.0 for key in compartments}
+    for edge in edges.values():
+        key1, key2 = edge["neighbors"]
+        comp1, comp2 = compartments[key1], compartments[key2]
+        distance = edge.get("distance") or (_voxel_size(comp1, spacing) + _voxel_size(comp2, spacing)) / 2
+        conc1 = comp1["Shared Environment"]["concentrations"]
+        conc2 = comp2["Shared Environment"]["concentrations"]
+        gradient = max(abs(conc2[substrate] - conc1[substrate]) / distance for substrate in substrates)
+        gradients[key1] = max(gradients[key1], gradient)
+        gradients[key2] = max(gradients[key2], gradient)
+    return gradients
+
+def adapt_voxels(compartments, edges, substrates, refine_threshold, coarsen_threshold=None, max_level=2,
+                 periodic=False, spacing=1.0, num_dims=3):
+    """
+    Refines voxels in regions of steep gradients and coarsens them where the field is smooth.
+
+    Parameters:
+        compartments: dict, voxels with Shared Environments
+        edges: dict, current edges between the voxels
+        substrates: list of str, substrates whose gradients drive the adaptation
+        refine_threshold: float, voxels with a gradient above this are split
+        coarsen_threshold: float, siblings that all have a gradient below this are merged (None disables)
+        max_level: int, maximum number of refinements of a voxel of the base grid
+        periodic: bool, periodic boundaries when regenerating edges
+        spacing: float, spacing of the base grid
+        num_dims: int, number of dimensions (2 or 3)
+
+    Returns:
+        compartments, edges: the adapted voxels and their new edges
+    """
+    gradients = get_voxel_gradients(compartments, edges, substrates, spacing=spacing)
+    refine = [key for key, gradient in gradients.items()
+              if gradient > refine_threshold and key.count(".") < max_level]
+    parents = []
+    if coarsen_threshold is not None:
+        n_children = len(_child_offsets(num_dims))
+        candidates = {key.rsplit(".", 1)[0] for key in compartments if "." in key}
+        parents = [parent for parent in candidates
+                   if all(gradients.get(f"{parent}.{i}", np.inf) < coarsen_threshold for i in range(n_children))]
+    compartments = coarsen_voxels(compartments, parents, spacing=spacing, num_dims=num_dims)
+    compartments = refine_voxels(compartments, [key for key in refine if key in compartments], spacing=spacing, num_dims=num_dims)
+    edges = get_adaptive_edges(compartments, periodic=periodic, spacing=spacing, num_dims=num_dims)
+    return compartments, edges
+
+#Voronoi Mesh Functions
+def _flatten_lists(lists):
+    """Flattens Voronoi vertex lists into (lengths, vertex indices, list index of each vertex)"""
+    lengths = np.fromiter(map(len, lists), dtype=int, count=len(lists))
+    flat = np.fromiter(itertools.chain.from_iterable(lists), dtype=int, count=lengths.sum())
+    owner = np.repeat(np.arange(len(lists)), lengths)
+    return lengths, flat, owner
+
+def get_voronoi_geometry(points, bounds=None, depth=1.0):
+    """
+    Computes the geometry of the Voronoi tessellation of seed points clipped to a box, in bulk.
+
+    Seeds whose cells reach past the box are mirrored across every face of the box, which closes their
+    cells exactly at the box. Every Voronoi face lies on the perpendicular bisector of its two seeds,
+    so a cell's volume is the sum of the pyramids from its seed to its faces,
+    area * distance / (2 * num_dims).
+
+    Parameters:
+        points: array-like (n, 2) or (n, 3), seed points strictly inside bounds
+        bounds: array-like (num_dims, 2), [min, max] of the box in each dimension; defaults to the
+                bounding box of the points padded by half the mean seed spacing
+        depth: float, thickness of 2D domains
+
+    Returns:
+        geometry: dict of arrays
+            "positions": (n, 3) seed positions (z = 0 in 2D)
+            "volumes": (n,) cell volumes
+            "neighbors": (m, 2) indices of the seeds sharing a face
+            "surface_areas": (m,) shared face areas
+            "distances": (m,) distances between the seeds
+    """
+    points = np.asarray(points, dtype=float)
+    n, num_dims = points.shape
+    if bounds is None:
+        low, high = points.min(axis=0), points.max(axis=0)
+        pad = 0.5 * (np.prod(high - low) / n) ** (1 / num_dims)
+        bounds = np.stack([low - pad, high + pad], axis=1)
+    bounds = np.asarray(bounds, dtype=float)
+    if bounds.shape != (num_dims, 2):
+        raise ValueError(f"bounds must have shape ({num_dims}, 2), got {bounds.shape}")
+    if not ((points > bounds[:, 0]) & (points < bounds[:, 1])).all():
+        raise ValueError("seed points must lie strictly inside bounds")
+
+    # only seeds with open cells or cells reaching past the box need mirror images
+    vor = Voronoi(points)
+    lengths, flat, owner = _flatten_lists([vor.regions[r] for r in vor.point_region])
+    outside = (flat < 0) | ((vor.vertices[flat] < bounds[:, 0]) | (vor.vertices[flat] > bounds[:, 1])).any(axis=1)
+    boundary = np.flatnonzero((np.bincount(owner, weights=outside, minlength=n) > 0) | (lengths == 0))
+
+    mirrored = [points]
+    for dim in range(num_dims):
+        for side in bounds[dim]:
+            mirror = points[boundary]
+            mirror[:, dim] = 2 * side - mirror[:, dim]
+            mirrored.append(mirror)
+    all_points = np.concatenate(mirrored)
+    vor = Voronoi(all_points)
+
+    # ridges bounding at least one original cell, these are all closed
+    keep = np.flatnonzero(vor.ridge_points.min(axis=1) < n)
+    ridge_points = vor.ridge_points[keep]
+    lengths, flat, owner = _flatten_lists([vor.ridge_vertices[r] for r in keep])
+    vertices = vor.vertices[flat]
+
+    separation = all_points[ridge_points[:, 1]] - all_points[ridge_points[:, 0]]
+    distances = np.linalg.norm(separation, axis=1)
+
+    if num_dims == 2:
+        ends = vertices.reshape(-1, 2, 2)
+        areas = np.linalg.norm(ends[:, 1] - ends[:, 0], axis=1) * depth
+    else:
+        centers = np.zeros((len(keep), 3))
+        np.add.at(centers, owner, vertices)
+        centers /= lengths[:, None]
+
+        # order the vertices of each face by angle around its center, then fan-triangulate
+        normals = separation / distances[:, None]
+        helper = np.eye(3)[np.argmin(np.abs(normals), axis=1)]
+        u = np.cross(normals, helper)
+        u /= np.linalg.norm(u, axis=1)[:, None]
+        w = np.cross(normals, u)
+        relative = vertices - centers[owner]
+        angles = np.arctan2(np.einsum("ij,ij->i", relative, w[owner]),
+                            np.einsum("ij,ij->i", relative, u[owner]))
+        order = np.lexsort((angles, owner))
+        relative = relative[order]
+        starts = np.cumsum(lengths) - lengths
+        following = np.arange(len(flat)) + 1
+        following[starts + lengths - 1] = starts
+        triangles = 0.5 * np.linalg.norm(np.cross(relative, relative[following]), axis=1)
+        areas = np.bincount(owner, weights=triangles, minlength=len(keep))
+
+    pyramids = areas * distances / (2 * num_dims)
+    volumes = np.zeros(n)
+    for side in range(2):
+        inside = ridge_points[:, side] < n
+        volumes += np.bincount(ridge_points[inside, side], weights=pyramids[inside], minlength=n)
+
+    internal = (ridge_points < n).all(axis=1)
+    positions = np.zeros((n, 3))
+    positions[:, :num_dims] = points
+
+    return {
+        "positions": positions,
+        "volumes": volumes,
+        "neighbors": ridge_points[internal],
+        "surface_areas": areas[internal],
+        "distances": distances[internal],
+    }
+
+def generate_voronoi_environments(geometry, substrates):
+    """Creates compartments with random substrate concentrations for the cells of get_voronoi_geometry"""
+    comps = {}
+    for i, (position, volume) in enumerate(zip(geometry["positions"].tolist(), geometry["volumes"].tolist())):
+        comps[f"{i}"] = {"position": position}
+        comps[f"{i}"]['Shared Environment'] = {}
+        comps[f"{i}"]['Shared Environment']['volume'] = volume
+        comps[f"{i}"]['Shared Environment']['counts'] = {}
+        comps[f"{i}"]['Shared Environment']['concentrations'] = {}
+        for substrate in substrates:
+            concentration = random.uniform(0, 10)
+            comps[f"{i}"]['Shared Environment']['counts'][substrate] = concentration*volume
+            comps[f"{i}"]['Shared Environment']['concentrations'][substrate] = concentration
+    compartments = comps
+    return compartments
+
+def get_voronoi_edges(geometry):
+    """Generates list of edge dictionaries for the shared faces of get_voronoi_geometry"""
+    edges = {
+        f"{i + 1}": {
+            "neighbors": [f"{a}", f"{b}"],
+            "surface_area": area,
+            "distance": distance,
+            "periodic": False,
+        }
+        for i, ((a, b), area, distance) in enumerate(zip(geometry["neighbors"].tolist(),
+                                                         geometry["surface_areas"].tolist(),
+                                                         geometry["distances"].tolist()))
+    }
+    return edges
+
 def generate_shared_environment(volume, substrates, species, sub_range=(0, 10), bio_range=(0, 0.1)):
     shared_environment = {'volume': volume, 'counts': {}, 'concentrations': {}}
     for substrate in substrates:
@@ -127,9 +511,9 @@ def detect_boundary_positions(compartments, num_dims = 3, spacing=1.0):
     Determines which compartments lie on the boundaries of the 3D domain
     and which specific boundaries (x_min, x_max, y_min, etc.) they touch.
 
-    compartments: dict of form {key: {'position': (x, y, z)}}
+    compartments: dict of form {key: {'position': (x, y, z)}}, optionally with a 'size' per voxel
     num_dims: int, number of dimensions
-    spacing: grid spacing (used for floating point tolerance)
+    spacing: grid spacing, the edge length of voxels without a 'size' (used for floating point tolerance)
 
     Returns:
         boundary_info: dict {key: [list of boundary labels]}
@@ -137,41 +521,111 @@ def detect_boundary_positions(compartments, num_dims = 3, spacing=1.0):
     """
     import numpy as np
 
-    # Get all positions
+    # Get the lower and upper corners of all voxels, so that voxels of mixed sizes are handled
     positions = np.array([v['position'] for v in compartments.values()])
-    x_vals, y_vals, z_vals = positions[:, 0], positions[:, 1], positions[:, 2]
-
-    x_min, x_max = x_vals.min(), x_vals.max()
-    y_min, y_max = y_vals.min(), y_vals.max()
-    z_min, z_max = z_vals.min(), z_vals.max()
-
-    tolerance = spacing / 10  # To handle floating-point rounding
+    sizes = np.array([_voxel_size(v, spacing) for v in compartments.values()])
+    lower = positions - sizes[:, None] / 2
+    upper = positions + sizes[:, None] / 2
+    domain_min = lower.min(axis=0)
+    domain_max = upper.max(axis=0)
 
-    boundary_info = {}
+    tolerance = sizes.min() / 10  # To handle floating-point rounding
 
-    for key, comp in compartments.items():
-        x, y, z = comp['position']
+    labels = ['x', 'y', 'z'][:num_dims]
+    for i, (key, comp) in enumerate(compartments.items()):
         boundaries = []
-        if np.isclose(x, x_min, atol=tolerance): boundaries.append('x_min')
-        if np.isclose(x, x_max, atol=tolerance): boundaries.append('x_max')
-        if np.isclose(y, y_min, atol=tolerance): boundaries.append('y_min')
-        if np.isclose(y, y_max, atol=tolerance): boundaries.append('y_max')
-        if num_dims == 3:
-            if np.isclose(z, z_min, atol=tolerance): boundaries.append('z_min')
-            if np.isclose(z, z_max, atol=tolerance): boundaries.append('z_max')
+        for dim, label in enumerate(labels):
+            if np.isclose(lower[i, dim], domain_min[dim], atol=tolerance): boundaries.append(f'{label}_min')
+            if np.isclose(upper[i, dim], domain_max[dim], atol=tolerance): boundaries.append(f'{label}_max')
         compartments[key]["boundaries"] = boundaries
 
     return compartments
 
 #cdFBA Utility Functions
-def generate_simple_cdfba_composite(voxels, model_dict, exchanges, volume, sub_range=(0, 10), bio_range=(0, 0.1)):
+def copy_spec(spec, shared=("config",)):
+    """
+    Copies the nested dicts and lists of a spec, sharing the values under the keys in shared.
+
+    Each copy owns the containers that hold state and process instances, so nothing a voxel writes
+    reaches another voxel, while read-only process configs are referenced rather than duplicated.
+    """
+    if isinstance(spec, dict):
+        return {key: value if key in shared else copy_spec(value, shared) for key, value in spec.items()}
+    if isinstance(spec, list):
+        return [copy_spec(value, shared) for value in spec]
+    return spec
+
+def make_cached_cdfba_composite(model_dict, exchanges, volume=1, interval=1.0, coupling="sequential", workers=0):
+    """
+    Constructs the same cdFBA composite spec as cdFBA's make_cdfba_composite with an exchanges list, but
+    from the models cached by load_model, so no model is parsed again, and with CachedDFBA processes.
+
+    Parameters:
+        model_dict: dict, {species: model file}
+        exchanges: list of str, exchange reactions shared through the environment
+        volume: float, volume of the cdFBA composite
+        interval: float, interval of the cdFBA processes
+        coupling: str, "sequential" to solve in place or "pool" to solve in a process pool (see CachedDFBA)
+        workers: int, number of worker processes of the pool, 0 for one per CPU
+    """
+    models = {species: load_model(model_file) for species, model_file in model_dict.items()}
+    spec = {DFBA_RESULTS: {}}
+    initial_counts = get_initial_counts(models, exchanges=exchanges)
+    spec[SHARED_ENVIRONMENT] = initial_environment(volume=volume, initial_counts=initial_counts, species_list=models.keys())
+    spec[SPECIES_STORE] = {}
+    for species, model in models.items():
+        config = dfba_config(
+            model_file=model_dict[species],
+            model=model,
+            name=species,
+            kinetics=get_kinetics(model_file=model, exchanges=exchanges),
+            reaction_map=get_reaction_map(model_file=model, exchanges=exchanges),
+            bounds={}
+        )
+        config["coupling"] = coupling
+        config["workers"] = workers
+        process_spec = get_single_dfba_spec(model_file=model, name=species, config=config, interval=interval)
+        process_spec["address"] = "local:CachedDFBA"
+        spec[SPECIES_STORE][species] = process_spec
+        spec[DFBA_RESULTS][species] = {substrate: 0 for substrate in get_substrates(model_file=model, exchanges=exchanges)}
+        spec[DFBA_RESULTS][species].update({species: 0})
+    spec["update environment"] = environment_spec()
+    return spec
+
+def generate_simple_cdfba_composite(voxels, model_dict, exchanges, volume, sub_range=(0, 10), bio_range=(0, 0.1), interval=0.1,
+                                    coupling="sequential", workers=0):
+    """
+    Adds a cdFBA composite with a random Shared Environment to every voxel
+
+    Each model is parsed once (see load_model) and the cdFBA spec is built once from the parsed
+    models (see make_cached_cdfba_composite). All voxels share one configured model per species
+    instead of parsing it per voxel. Every voxel gets its own copy of the spec containers up front,
+    sharing only the process configs; the copies are not created lazily, since the Composite
+    reads the whole spec of every voxel when it is built.
+
+    With coupling "pool", transport only runs alongside the pooled solves if the transport processes
+    come after the voxels in the Composite spec, so that the solves are submitted first; add the
+    voxels to the spec before the transport processes.
+
+    Parameters:
+        voxels: dict, voxels from generate_voxels
+        model_dict: dict, {species: model file}
+        exchanges: list of str, exchange reactions shared through the environment
+        volume: float, volume passed to the cdFBA composite
+        sub_range: tuple, range of the random initial substrate counts
+        bio_range: tuple, range of the random initial biomass
+        interval: float, interval of the cdFBA processes
+        coupling: str, "sequential" to solve in place or "pool" to solve in a process pool (see CachedDFBA)
+        workers: int, number of worker processes of the pool, 0 for one per CPU
+    """
     substrates = []
     species_list = [species for species in model_dict.keys()]
     for species, model in model_dict.items():
-        substrates += get_substrates(model_file=model, exchanges=exchanges)
-    base_spec = make_cdfba_composite(model_dict=model_dict, exchanges=exchanges, volume=volume, interval=0.1)
+        substrates += get_substrates(model_file=load_model(model), exchanges=exchanges)
+    base_spec = make_cached_cdfba_composite(model_dict=model_dict, exchanges=exchanges, volume=volume, interval=interval,
+                                            coupling=coupling, workers=workers)
     for id in voxels:
-        spec = base_spec.copy()
+        spec = copy_spec(base_spec)
         shared_environment = generate_shared_environment(volume=1, substrates=substrates, species=species_list, sub_range=sub_range, bio_range=bio_range)
         spec["Shared Environment"] = shared_environment
         voxels[id].update(spec)